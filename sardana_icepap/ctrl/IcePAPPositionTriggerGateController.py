@@ -40,6 +40,10 @@ class IcePAPPositionTriggerGateController(TriggerGateController):
 
     ActivePeriod = 50e-6 # 50 micro seconds
 
+    # Axis parameters accepted by SetAxisPar
+    _AXIS_PARS = frozenset(['offset', 'passive_interval', 'repetitions',
+                            'sign', 'info_channels'])
+
     # The properties used to connect to the ICEPAP motor controller
     ctrl_properties = {
         'Motors': {Type: str,
@@ -147,9 +151,7 @@ class IcePAPPositionTriggerGateController(TriggerGateController):
         idx = axis - 1
         tg = self.triggers[idx]
         name = name.lower()
-        pars = ['offset', 'passive_interval', 'repetitions', 'sign',
-                 'info_channels']
-        if name in pars:
+        if name in self._AXIS_PARS:
             tg[name] = value
 
     def GetAxisPar(self, axis, name):
@@ -21,6 +21,8 @@
 ##
 ##############################################################################
 import time
+import logging
+import functools
 import numpy
 from sardana import State
 from sardana.pool.pooldefs import SynchDomain, SynchParam
@@ -37,6 +39,16 @@ ECAM = 'ecam'
 
 MAX_ECAM_VALUES = 20477
 
+# Time (in seconds) during which the motor step_per_unit, offset and sign
+# read from Tango are considered valid.
+MOTOR_ATTRS_TTL = 1
+
+
+@functools.lru_cache(maxsize=32)
+def _get_device(name):
+    # Share the device proxies between controller (re)initializations
+    return taurus.Device(name)
+
 
 class IcePAPTriggerController(TriggerGateController):
     """Basic IcePAPPositionTriggerGateController.
@@ -50,6 +62,10 @@ class IcePAPTriggerController(TriggerGateController):
 
     ActivePeriod = 50e-6  # 50 micro seconds
 
+    # Axis parameters accepted by SetAxisPar
+    _AXIS_PARS = frozenset(['offset', 'passive_interval', 'repetitions',
+                            'sign', 'info_channels'])
+
     # The properties used to connect to the ICEPAP motor controller
     ctrl_properties = {
         'IcepapController': {
@@ -110,15 +126,15 @@ class IcePAPTriggerController(TriggerGateController):
         self._time_mode = False
         self._start_trigger_only = False
         self._use_master_out = self.UseMasterOut
-        self._axis_info_list = list(map(str.strip, self.AxisInfos.split(',')))
+        # The icepap axis exposes the InfoX outputs as lower case properties
+        self._axis_info_list = tuple(info.strip().lower()
+                                     for info in self.AxisInfos.split(','))
 
         # Calculate the number of retries according to the timeout and the
-        # default Tango timeout (3s)
-        self._retries_nr = 3 // (self.Timeout + 0.1)
-        if self._retries_nr == 0:
-            self._retries_nr = 1
-        self._retries_nr = int(self._retries_nr)
-        self._ipap_ctrl = taurus.Device(self.IcepapController)
+        # default Tango timeout (3s): every retry can take up to the socket
+        # timeout plus ~0.1s of reconnection overhead, at least one try.
+        self._retries_nr = max(1, int(3.0 / (self.Timeout + 0.1)))
+        self._ipap_ctrl = _get_device(self.IcepapController)
         properties = self._ipap_ctrl.get_property(['host', 'port'])
         host = properties['host'][0]
         port = int(properties['port'][0])
@@ -126,62 +142,141 @@ class IcePAPTriggerController(TriggerGateController):
                                              timeout=self.Timeout,
                                              auto_axes=True)
         self._last_motor_name = None
+        self._motor_cache = {}
         self._motor_axis = None
+        self._ipap_motor = None
+        self._info_setters = ()
         self._motor_spu = 1
         self._motor_offset = 0
         self._motor_sign = 1
+        self._motor_scale = 1
         self._is_tgtenc = False
+        self._ecam_buf = numpy.empty(MAX_ECAM_VALUES, dtype=numpy.float64)
+        self._ecam_index = numpy.arange(MAX_ECAM_VALUES, dtype=numpy.float64)
 
     def _set_out(self, out=LOW):
-        motor = self._ipap[self._motor_axis]
+        motor = self._ipap_motor
         value = [out, 'normal']
         if self._use_master_out:
             motor.syncaux = value
         else:
-            for info_out in self._axis_info_list:
-                setattr(motor, info_out, value)
-        print(motor.syncaux)
+            for setter in self._info_setters:
+                setter(value)
+        # Reading the output configuration costs an extra round-trip
+        if self._log.log_obj.isEnabledFor(logging.DEBUG):
+            self._log.debug('syncaux=%s', motor.syncaux)
 
-    def _configureMotor(self, motor_name):
+    def _configureMotor(self, motor_name, refresh=False):
         if motor_name is None:
             motor_name = self.DefaultMotor
 
         # TODO: Implement verification of the motor if it is part of the
         #  controller.
 
-        self._last_motor_name = motor_name
-        motor = taurus.Device(self._last_motor_name)
-        self._motor_axis = int(motor.get_property('axis')['axis'][0])
-        attrs = motor.read_attributes(['step_per_unit', 'offset', 'sign'])
-        values = [attr.value for attr in attrs]
-        self._motor_spu, self._motor_offset, self._motor_sign = values
-
-        if motor_name == self._last_motor_name:
+        entry = self._motor_cache.get(motor_name)
+        if entry is None:
+            motor = _get_device(motor_name)
+            axis = int(motor.get_property('axis')['axis'][0])
+            entry = {'device': motor, 'axis': axis, 'values': None,
+                     'timestamp': None}
+            self._motor_cache[motor_name] = entry
+
+        now = time.monotonic()
+        if refresh or entry['timestamp'] is None or \
+                now - entry['timestamp'] > MOTOR_ATTRS_TTL:
+            attrs = entry['device'].read_attributes(['step_per_unit',
+                                                     'offset', 'sign'])
+            entry['values'] = [attr.value for attr in attrs]
+            entry['timestamp'] = now
+        self._motor_spu, self._motor_offset, self._motor_sign = \
+            entry['values']
+        if self._motor_sign == 0:
+            raise RuntimeError('The motor {0} has an invalid sign '
+                               '(0)'.format(motor_name))
+        # The sign is +/-1, multiplying by it is the same than dividing
+        self._motor_scale = self._motor_spu * self._motor_sign
+
+        # A refresh also reconfigures the PMUX of an unchanged motor, e.g.
+        # to recover it after E0 was changed externally.
+        if motor_name == self._last_motor_name and not refresh:
             return
 
+        axis = entry['axis']
+        ipap_motor = self._ipap[axis]
         if self._use_master_out:
             # remove previous connection and connect the new motor
             pmux = self._ipap.get_pmux()
-            for p in pmux:
-                if 'E0' in p:
+            e0_cfg = self._get_e0_pmux(pmux)
+            if e0_cfg is not None and self._is_e0_pmux_motor(e0_cfg, axis):
+                self._log.debug('_connectMotor PMUX already '
+                                'configured: {0}'.format(pmux))
+            else:
+                if e0_cfg is not None:
                     self._ipap.clear_pmux('e0')
-                    break
-            self._ipap.add_pmux(self._motor_axis, 'e0', pos=False, aux=True,
-                                hard=True)
+                self._ipap.add_pmux(axis, 'e0', pos=False, aux=True,
+                                    hard=True)
 
-            pmux = self._ipap.get_pmux()
-            self._log.debug('_connectMotor PMUX={0}'.format(pmux))
+                # Reading back the configuration costs an extra round-trip
+                if self._log.log_obj.isEnabledFor(logging.DEBUG):
+                    pmux = self._ipap.get_pmux()
+                    self._log.debug('_connectMotor PMUX={0}'.format(pmux))
+
+        # Change the motor only when its configuration succeeded, otherwise
+        # the next call would not retry it.
+        self._last_motor_name = motor_name
+        self._motor_axis = axis
+        self._ipap_motor = ipap_motor
+        self._info_setters = tuple(
+            functools.partial(setattr, ipap_motor, info_out)
+            for info_out in self._axis_info_list)
+
+    @staticmethod
+    def _get_e0_pmux(pmux):
+        """Return the tokens of the PMUX configuration with E0 as
+        destination or None if there is not any.
+        """
+        if not pmux:
+            return None
+        # The icepap library returns a single configuration as a list of
+        # tokens instead of a list of lines.
+        if all(len(p.split()) == 1 for p in pmux):
+            pmux = [' '.join(pmux)]
+        for p in pmux:
+            tokens = p.upper().split()
+            if tokens and tokens[-1] == 'E0':
+                return tokens
+        return None
+
+    @staticmethod
+    def _is_e0_pmux_motor(e0_cfg, axis):
+        """Check if the E0 PMUX configuration is the one done by
+        _configureMotor for the given axis: HARD AUX B<axis> E0.
+        """
+        if len(e0_cfg) < 2 or 'POS' in e0_cfg or 'HARD' not in e0_cfg or \
+                'AUX' not in e0_cfg:
+            return False
+        return e0_cfg[-2] == 'B{0}'.format(axis)
 
     def StateOne(self, axis):
         """Get the trigger/gate state"""
         # self._log.debug('StateOne(%d): entering...' % axis)
         hw_state = None
+        # Retry only on communication errors, with a backoff bounded by the
+        # time budget used to calculate the number of retries.
+        deadline = time.monotonic() + self.Timeout * self._retries_nr
         for i in range(self._retries_nr):
+            if self._ipap_motor is None:
+                break
             try:
-                hw_state = self._ipap[self._motor_axis].state
+                hw_state = self._ipap_motor.state
                 break
-            except Exception:
+            except (RuntimeError, OSError):
                 self._log.error('State reading error retry: {0}'.format(i))
+            backoff = 0.01 * 2 ** i
+            if i == self._retries_nr - 1 or \
+                    time.monotonic() + backoff >= deadline:
+                break
+            time.sleep(backoff)
 
         if hw_state is None or not hw_state.is_poweron():
             state = State.Alarm
@@ -208,15 +303,19 @@ class IcePAPTriggerController(TriggerGateController):
         """Overwrite the StartOne method"""
 
         if self._time_mode:
+            # 10 ms pulse, the HIGH command latency is part of the width
+            t0 = time.monotonic()
             self._set_out(out=HIGH)
-            time.sleep(0.01)
+            remaining = 0.01 - (time.monotonic() - t0)
+            if remaining > 0:
+                time.sleep(remaining)
             self._set_out(out=LOW)
             return
 
         if self._is_tgtenc:
             self._log.info('Send ESYNC to motor: %s',
-                           self._ipap[self._motor_axis].name)
-            self._ipap[self._motor_axis].esync()
+                           self._ipap_motor.name)
+            self._ipap_motor.esync()
 
     def AbortOne(self, axis):
         """Start the specified trigger"""
@@ -227,9 +326,7 @@ class IcePAPTriggerController(TriggerGateController):
         idx = axis - 1
         tg = self.triggers[idx]
         name = name.lower()
-        pars = ['offset', 'passive_interval', 'repetitions', 'sign',
-                'info_channels']
-        if name in pars:
+        if name in self._AXIS_PARS:
             tg[name] = value
 
     def GetAxisPar(self, axis, name):
@@ -262,7 +359,11 @@ class IcePAPTriggerController(TriggerGateController):
                 raise RuntimeError('The motor used in the scan is not the '
                                    'same than the motor configure with the '
                                    'trigger cable')
-            self._configureMotor(self._last_motor_name)
+            # The time mode only uses the motor outputs: configure the
+            # default motor if there is not any yet, otherwise nothing
+            # changed since the last configuration.
+            if self._last_motor_name is None:
+                self._configureMotor(None)
             return
 
         self._time_mode = False
@@ -274,7 +375,7 @@ class IcePAPTriggerController(TriggerGateController):
         # Check target encoder configuration to send ESYNC on StartOne
         try:
             tgtenc_cfg = \
-                self._ipap[self._motor_axis].get_cfg('TGTENC')['TGTENC']
+                self._ipap_motor.get_cfg('TGTENC')['TGTENC']
             self._is_tgtenc = tgtenc_cfg == 'NONE'
         except Exception as e:
             self._log.error('SynchOne(%d).\nException:\n%s' % (axis, str(e)))
@@ -291,8 +392,8 @@ class IcePAPTriggerController(TriggerGateController):
         delta_user = synch_group[SynchParam.Total][SynchDomain.Position]
 
         start_user -= self._motor_offset
-        start = start_user * self._motor_spu/self._motor_sign
-        delta = delta_user * self._motor_spu/self._motor_sign
+        start = start_user * self._motor_scale
+        delta = delta_user * self._motor_scale
 
         end = start + delta * nr_points
         self._log.debug('IcepapTriggerCtr configuration: %f %f %d %d' %
@@ -307,22 +408,29 @@ class IcePAPTriggerController(TriggerGateController):
         # agains list with repeated elements
 
         if self._start_trigger_only:
-            trigger_table = numpy.array([start])
+            # The icepap library has no single position ECAMDAT command,
+            # load a one position table from the preallocated buffer.
+            trigger_table = self._ecam_buf[:1]
+            trigger_table[0] = start
             self._log.debug('Start trigger only flag is active.')
         elif nr_points > MAX_ECAM_VALUES:
             msg = 'The Trigger by position not accept more than {0} ' \
                   'positions (points)'.format(MAX_ECAM_VALUES)
             raise RuntimeError(msg)
         else:
-            trigger_table = numpy.linspace(start, end - delta,
-                                           int(nr_points))
-            self._log.debug('Table generated by numpy.linspace({0},{1},'
-                            '{2}'.format(start, end-delta, nr_points))
+            # Fill the preallocated buffer in place: start + delta * i
+            nr_points = int(nr_points)
+            trigger_table = self._ecam_buf[:nr_points]
+            numpy.multiply(self._ecam_index[:nr_points], delta,
+                           out=trigger_table)
+            trigger_table += start
+            self._log.debug('Table generated from {0} to {1} with {2} '
+                            'points'.format(start, end-delta, nr_points))
 
         table_loaded = False
         for i in range(self._retries_nr):
             try:
-                self._ipap[self._motor_axis].set_ecam_table(trigger_table)
+                self._ipap_motor.set_ecam_table(trigger_table)
                 table_loaded = True
                 break
             except Exception:
@@ -335,7 +443,7 @@ class IcePAPTriggerController(TriggerGateController):
     #               Axis Extra Parameters
     # -------------------------------------------------------------------------
     def setMasterMotor(self, axis, value):
-        self._configureMotor(value)
+        self._configureMotor(value, refresh=True)
 
     def getMasterMotor(self, axis):
         return self._last_motor_name
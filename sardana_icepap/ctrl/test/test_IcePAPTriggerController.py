@@ -0,0 +1,312 @@
+import sys
+import numpy
+import pytest
+
+from sardana import State
+from sardana.pool.pooldefs import SynchDomain, SynchParam
+from sardana.pool.controller import TriggerGateController
+from sardana_icepap.ctrl.IcePAPTriggerController import \
+    IcePAPTriggerController
+
+# The ctrl package exports the class with the same name than its module
+ctrl_module = sys.modules[IcePAPTriggerController.__module__]
+
+
+PROPS = {'IcepapController': 'ipap_ctrl',
+         'DefaultMotor': 'mot01',
+         'UseMasterOut': True,
+         'AxisInfos': 'InfoA, InfoB',
+         'Timeout': 0.5}
+
+AXES = {'mot01': 1, 'mot02': 2}
+
+
+class attribute:
+    def __init__(self, value):
+        self.value = value
+
+
+def device(name):
+    dev = device.mocker.MagicMock()
+    if name == PROPS['IcepapController']:
+        dev.get_property.return_value = {'host': ['icepap01'],
+                                         'port': ['5000']}
+    else:
+        dev.get_property.return_value = {'axis': [str(AXES[name])]}
+        dev.read_attributes.return_value = [attribute(100.),
+                                            attribute(0.),
+                                            attribute(1)]
+    return dev
+
+
+@pytest.fixture
+def ipap(mocker):
+    ipap = mocker.MagicMock()
+    ipap.get_pmux.return_value = None
+    mocker.patch.object(ctrl_module.icepap, 'IcePAPController',
+                        return_value=ipap)
+    return ipap
+
+
+@pytest.fixture
+def ctrl(mocker, ipap):
+    def init(self, inst, props, *args, **kwargs):
+        self._log = mocker.MagicMock()
+        self._log.log_obj.isEnabledFor.return_value = False
+        for name, value in props.items():
+            setattr(self, name, value)
+
+    mocker.patch.object(TriggerGateController, '__init__', init)
+    device.mocker = mocker
+    mocker.patch.object(ctrl_module.taurus, 'Device',
+                        side_effect=device)
+    ctrl_module._get_device.cache_clear()
+    yield IcePAPTriggerController('ctrl', dict(PROPS))
+    ctrl_module._get_device.cache_clear()
+
+
+def test_configure_motor_pmux_error(ctrl, ipap):
+    ipap.add_pmux.side_effect = RuntimeError('IcePAP answered ERROR')
+    with pytest.raises(RuntimeError):
+        ctrl._configureMotor('mot01')
+    assert ctrl._last_motor_name is None
+    assert ctrl._ipap_motor is None
+
+    ipap.add_pmux.side_effect = None
+    ctrl._configureMotor('mot01')
+    assert ipap.add_pmux.call_count == 2
+    assert ctrl._last_motor_name == 'mot01'
+    assert ctrl._motor_axis == 1
+
+
+
+def test_set_out_writes_repeated_values(ctrl, mocker):
+    ctrl._configureMotor('mot01')
+    ctrl._ipap_motor = motor = mocker.MagicMock()
+    syncaux = mocker.PropertyMock()
+    type(motor).syncaux = syncaux
+    ctrl.PreStartOne(1)
+    ctrl.PreStartOne(1)
+    ctrl.AbortOne(1)
+    ctrl.AbortOne(1)
+    assert syncaux.call_args_list == [mocker.call(['ecam', 'normal'])] * 2 \
+        + [mocker.call(['low', 'normal'])] * 2
+
+
+def test_set_out_axis_infos(ctrl, mocker):
+    ctrl._use_master_out = False
+    ctrl._configureMotor('mot01')
+    ctrl._set_out('high')
+    assert ctrl._ipap_motor.infoa == ['high', 'normal']
+    assert ctrl._ipap_motor.infob == ['high', 'normal']
+
+
+@pytest.mark.parametrize('pmux, expected', [
+    (None, None),
+    ([], None),
+    (['HARD', 'AUX', 'B1', 'E0'], ['HARD', 'AUX', 'B1', 'E0']),
+    (['hard', 'aux', 'b1', 'e0'], ['HARD', 'AUX', 'B1', 'E0']),
+    (['POS', 'AUX', 'B2', 'B3'], None),
+    (['POS AUX B2 B3', 'HARD AUX B1 E0'], ['HARD', 'AUX', 'B1', 'E0']),
+    (['POS AUX B2 B3', 'POS B4 B5'], None),
+])
+def test_get_e0_pmux(pmux, expected):
+    assert IcePAPTriggerController._get_e0_pmux(pmux) == expected
+
+
+@pytest.mark.parametrize('e0_cfg, axis, expected', [
+    (['HARD', 'AUX', 'B1', 'E0'], 1, True),
+    (['HARD', 'AUX', 'B1', 'E0'], 11, False),
+    (['HARD', 'AUX', 'B11', 'E0'], 1, False),
+    (['HARD', 'AUX', 'E5', 'E0'], 5, False),
+    (['HARD', 'POS', 'AUX', 'B1', 'E0'], 1, False),
+    (['AUX', 'B1', 'E0'], 1, False),
+    (['HARD', 'B1', 'E0'], 1, False),
+    (['E0'], 1, False),
+])
+def test_is_e0_pmux_motor(e0_cfg, axis, expected):
+    assert IcePAPTriggerController._is_e0_pmux_motor(e0_cfg, axis) == \
+        expected
+
+
+def test_init_creates_icepap(ctrl, ipap):
+    IcePAPTriggerController('ctrl', dict(PROPS))
+    ipap_class = ctrl_module.icepap.IcePAPController
+    assert ipap_class.call_count == 2
+    ipap_class.assert_called_with(host='icepap01', port=5000, timeout=0.5,
+                                  auto_axes=True)
+    assert ctrl._ipap is ipap
+
+
+def test_master_motor_write_reconfigures_pmux(ctrl, ipap):
+    ctrl.setMasterMotor(1, 'mot01')
+    assert ipap.add_pmux.call_count == 1
+    ctrl._configureMotor('mot01')
+    assert ipap.add_pmux.call_count == 1
+    # E0 changed externally
+    ipap.get_pmux.return_value = ['HARD', 'AUX', 'B2', 'E0']
+    ctrl.setMasterMotor(1, 'mot01')
+    ipap.clear_pmux.assert_called_once_with('e0')
+    assert ipap.add_pmux.call_count == 2
+    ipap.add_pmux.assert_called_with(1, 'e0', pos=False, aux=True,
+                                     hard=True)
+
+
+def position_configuration(initial, total, repeats):
+    return [{SynchParam.Initial: {SynchDomain.Position: initial},
+             SynchParam.Total: {SynchDomain.Position: total},
+             SynchParam.Repeats: repeats}]
+
+
+def test_synch_reads_tgtenc(ctrl, mocker):
+    ctrl._configureMotor('mot01')
+    ctrl._ipap_motor = motor = mocker.MagicMock()
+    motor.get_cfg.return_value = {'TGTENC': 'NONE'}
+    ctrl.SynchOne(1, position_configuration(0, 1, 10))
+    assert ctrl._is_tgtenc
+    motor.get_cfg.return_value = {'TGTENC': 'ENCIN'}
+    ctrl.SynchOne(1, position_configuration(0, 1, 10))
+    assert not ctrl._is_tgtenc
+    assert motor.get_cfg.call_count == 2
+
+
+def test_motor_cache(ctrl, mocker):
+    monotonic = mocker.patch.object(ctrl_module.time, 'monotonic',
+                                    return_value=10.)
+    ctrl._configureMotor('mot01')
+    ctrl._configureMotor('mot01')
+    ctrl._configureMotor(None)
+    entry = ctrl._motor_cache['mot01']
+    device = entry['device']
+    assert ctrl_module.taurus.Device.call_count == 2  # ipap ctrl + mot01
+    assert device.get_property.call_count == 1
+    assert device.read_attributes.call_count == 1
+    assert (ctrl._motor_spu, ctrl._motor_offset, ctrl._motor_sign) == \
+        (100., 0., 1)
+
+    # values expired
+    monotonic.return_value = 10. + ctrl_module.MOTOR_ATTRS_TTL + 0.1
+    device.read_attributes.return_value = [attribute(50.), attribute(2.),
+                                           attribute(-1)]
+    ctrl._configureMotor('mot01')
+    assert device.read_attributes.call_count == 2
+    assert ctrl._motor_scale == -50.
+    assert ctrl._motor_offset == 2.
+
+    # a MasterMotor write always reads them
+    ctrl.setMasterMotor(1, 'mot01')
+    assert device.read_attributes.call_count == 3
+
+    ctrl._configureMotor('mot02')
+    assert ctrl._motor_axis == 2
+    assert ctrl_module.taurus.Device.call_count == 3
+
+
+def test_motor_invalid_sign(ctrl):
+    ctrl._configureMotor('mot01')
+    device = ctrl._motor_cache['mot01']['device']
+    device.read_attributes.return_value = [attribute(100.), attribute(0.),
+                                           attribute(0)]
+    with pytest.raises(RuntimeError):
+        ctrl._configureMotor('mot01', refresh=True)
+
+
+def hw_state(mocker, moving=False):
+    state = mocker.MagicMock()
+    state.is_poweron.return_value = True
+    state.is_moving.return_value = moving
+    state.is_settling.return_value = False
+    return state
+
+
+def test_state_one_not_configured(ctrl):
+    state, _ = ctrl.StateOne(1)
+    assert state == State.Alarm
+
+
+def test_state_one_retry(ctrl, mocker):
+    sleep = mocker.patch.object(ctrl_module.time, 'sleep')
+    ctrl._configureMotor('mot01')
+    ctrl._ipap_motor = motor = mocker.MagicMock()
+    type(motor).state = mocker.PropertyMock(
+        side_effect=[RuntimeError('ERROR'), OSError('timeout'),
+                     hw_state(mocker, moving=True)])
+    state, _ = ctrl.StateOne(1)
+    assert state == State.Moving
+    assert sleep.call_args_list == [mocker.call(0.01), mocker.call(0.02)]
+
+
+def test_state_one_retries_exhausted(ctrl, mocker):
+    sleep = mocker.patch.object(ctrl_module.time, 'sleep')
+    ctrl._configureMotor('mot01')
+    ctrl._ipap_motor = motor = mocker.MagicMock()
+    state_attr = mocker.PropertyMock(side_effect=OSError('timeout'))
+    type(motor).state = state_attr
+    state, _ = ctrl.StateOne(1)
+    assert state == State.Alarm
+    assert state_attr.call_count == ctrl._retries_nr
+    assert sleep.call_count == ctrl._retries_nr - 1
+
+
+def test_state_one_deadline(ctrl, mocker):
+    sleep = mocker.patch.object(ctrl_module.time, 'sleep')
+    ctrl._configureMotor('mot01')
+    budget = ctrl.Timeout * ctrl._retries_nr
+    mocker.patch.object(ctrl_module.time, 'monotonic',
+                        side_effect=[0., budget - 0.005])
+    ctrl._ipap_motor = motor = mocker.MagicMock()
+    state_attr = mocker.PropertyMock(side_effect=OSError('timeout'))
+    type(motor).state = state_attr
+    state, _ = ctrl.StateOne(1)
+    assert state == State.Alarm
+    assert state_attr.call_count == 1
+    sleep.assert_not_called()
+
+
+def test_state_one_unexpected_error(ctrl, mocker):
+    ctrl._configureMotor('mot01')
+    ctrl._ipap_motor = motor = mocker.MagicMock()
+    type(motor).state = mocker.PropertyMock(side_effect=ValueError)
+    with pytest.raises(ValueError):
+        ctrl.StateOne(1)
+
+
+@pytest.mark.parametrize('initial, total, repeats', [
+    (0, 1, 1),
+    (0, 1, 10),
+    (-2.5, 0.01, 1000),
+    (3, 0.3, ctrl_module.MAX_ECAM_VALUES),
+])
+def test_synch_ecam_table(ctrl, mocker, initial, total, repeats):
+    ctrl._configureMotor('mot01')
+    ctrl._ipap_motor = motor = mocker.MagicMock()
+    tables = []
+    motor.set_ecam_table.side_effect = lambda t: tables.append(t.copy())
+    ctrl.SynchOne(1, position_configuration(initial, total, repeats))
+    # spu = 100, offset = 0, sign = 1
+    start = initial * 100.
+    delta = total * 100.
+    end = start + delta * repeats
+    expected = numpy.linspace(start, end - delta, repeats)
+    assert len(tables) == 1
+    assert tables[0].dtype == numpy.float64
+    numpy.testing.assert_allclose(tables[0], expected)
+
+
+def test_synch_ecam_table_too_long(ctrl, mocker):
+    ctrl._configureMotor('mot01')
+    ctrl._ipap_motor = mocker.MagicMock()
+    configuration = position_configuration(
+        0, 1, ctrl_module.MAX_ECAM_VALUES + 1)
+    with pytest.raises(RuntimeError):
+        ctrl.SynchOne(1, configuration)
+
+
+def test_synch_start_trigger_only(ctrl, mocker):
+    ctrl._configureMotor('mot01')
+    ctrl._ipap_motor = motor = mocker.MagicMock()
+    tables = []
+    motor.set_ecam_table.side_effect = lambda t: tables.append(t.copy())
+    ctrl.setStartTriggerOnly(1, True)
+    ctrl.SynchOne(1, position_configuration(2, 1, 10))
+    numpy.testing.assert_array_equal(tables, [[200.]])